@@ -1,113 +1,412 @@
-import os, subprocess, tempfile, time, json, re, shutil
+import os, subprocess, time, json, re, shutil, shlex, threading
 from dataclasses import dataclass, asdict
 from typing import List, Dict, Optional, Tuple
-from unidiff import PatchSet
 
 from .llm import LLM
 from .memory_store import MemoryStore, MemoryItem
 from . import prompts
 
-def run(cmd: str, cwd: Optional[str] = None, timeout: int = 600) -> Tuple[int, str]:
-    p = subprocess.Popen(cmd, cwd=cwd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+_PATCH_RE = re.compile(r"```(?:diff|patch)?\n(.*?)\n```", re.DOTALL)
+_MEMITEM_SPLIT = re.compile(r"(?m)^# Memory Item .*?$")
+_TITLE_RE = re.compile(r"##\s*Title\s*(.+)")
+_DESC_RE = re.compile(r"##\s*Description\s*(.+)")
+_CONTENT_RE = re.compile(r"##\s*Content\s*(.+)", re.DOTALL)
+
+# A successful attempt skips memory extraction when the bank already holds a
+# success memory at least this similar to the issue.
+MEMORY_DEDUP_THRESHOLD = 0.85
+
+def run(argv: List[str], cwd: Optional[str] = None, timeout: int = 600, input: Optional[str] = None) -> Tuple[int, str]:
+    # argv is exec'd directly (no `sh -c`); split user command strings once with shlex.
+    if not argv:
+        return 127, "No command to run."
     try:
-        out, _ = p.communicate(timeout=timeout)
+        p = subprocess.run(argv, cwd=cwd, input=input, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, timeout=timeout)
     except subprocess.TimeoutExpired:
-        p.kill()
-        return 124, f"TIMEOUT running: {cmd}"
-    return p.returncode, out
+        return 124, f"TIMEOUT running: {shlex.join(argv)}"
+    except OSError as e:
+        return 127, f"Failed to run {shlex.join(argv)}: {e}"
+    return p.returncode, p.stdout
 
-def ensure_git(repo: str):
-    code, _ = run("git rev-parse --is-inside-work-tree", cwd=repo)
-    if code != 0:
+class GitSession:
+    """Git access for a single work tree.
+
+    Holds the resolved argv prefix so every call is a single direct
+    `git` exec (no intermediate shell) and callers can share one session
+    per repo instead of rebuilding command strings.
+    """
+    def __init__(self, repo: str):
+        self.repo = repo
+        self._argv = ["git", "-C", repo, "--no-pager"]
+        self._lg2 = None  # pygit2.Repository, opened on first in-process apply
+
+    def apply_in_process(self, patch_text: str) -> Optional[str]:
+        """Apply a unified diff to the work tree with libgit2, without spawning git.
+
+        Returns a log message on success, or None when pygit2 is not installed or
+        libgit2 cannot parse/apply the patch cleanly (callers then fall back to
+        `git apply --reject`, which also applies partial hunks).
+        """
+        try:
+            import pygit2
+        except ImportError:
+            return None
+        try:
+            if self._lg2 is None:
+                self._lg2 = pygit2.Repository(self.repo)
+            diff = pygit2.Diff.parse_diff(_git_style_patch(patch_text))
+            self._lg2.apply(diff, pygit2.GIT_APPLY_LOCATION_WORKDIR)
+        except (pygit2.GitError, ValueError, OSError):
+            # OSError: a target file the patch expects is missing from the work tree.
+            return None
+        files = ", ".join(d.new_file.path for d in diff.deltas)
+        return f"Applied patch in-process: {files}\n"
+
+    def git(self, *args: str, timeout: int = 600, input: Optional[str] = None) -> Tuple[int, str]:
+        return run(self._argv + list(args), timeout=timeout, input=input)
+
+    def checkout_branch(self, name: str) -> Tuple[int, str]:
+        return self.git("checkout", "-B", name)
+
+    def diff(self) -> str:
+        return self.git("diff")[1]
+
+    def status(self) -> Tuple[Optional[str], List[str]]:
+        """One `status --porcelain=v2 --branch` call -> (HEAD oid, short status lines).
+
+        The oid is None when the `# branch.oid` header is missing, i.e. `repo`
+        is not a git work tree.
+        """
+        code, out = self.git("status", "--porcelain=v2", "--branch")
+        if code != 0:
+            return None, []
+        oid = None
+        entries = []
+        for ln in out.splitlines():
+            if ln.startswith("# branch.oid "):
+                oid = ln[len("# branch.oid "):]
+            elif ln and not ln.startswith("#"):
+                entries.append(_short_status(ln))
+        return oid, entries
+
+    def apply(self, patch_text: str) -> Tuple[int, str]:
+        # Patch is fed on stdin, so no temp file is written per attempt.
+        return self.git("apply", "--reject", "--whitespace=nowarn", "-", input=patch_text)
+
+    def changed_paths(self) -> List[str]:
+        """Paths modified, added, deleted or untracked relative to HEAD."""
+        code, out = self.git("status", "--porcelain", "-z", "--untracked-files=all")
+        if code != 0:
+            return []
+        paths = []
+        recs = out.split("\0")
+        i = 0
+        while i < len(recs):
+            rec = recs[i]
+            i += 1
+            if len(rec) > 3:
+                paths.append(rec[3:])
+                if rec[0] in "RC":
+                    i += 1  # skip the rename/copy source
+        return paths
+
+    def common_dir(self) -> str:
+        """Absolute path of the repository's shared git directory.
+
+        Unlike `<repo>/.git`, this is a directory even when `repo` is itself a
+        linked work tree or a submodule (where `.git` is a file).
+        """
+        code, out = self.git("rev-parse", "--git-common-dir")
+        if code != 0:
+            raise RuntimeError(f"Could not locate the git directory of {self.repo}:\n{out}")
+        return os.path.normpath(os.path.join(self.repo, out.strip()))
+
+    def add_worktree(self, path: str, branch: str) -> Tuple[int, str]:
+        return self.git("worktree", "add", "-f", "-B", branch, path)
+
+    def remove_worktree(self, path: str) -> Tuple[int, str]:
+        return self.git("worktree", "remove", "--force", path)
+
+def _diff_path(line: str, prefix: str) -> Optional[str]:
+    path = line[4:].rstrip("\r\n").split("\t")[0]
+    if path == "/dev/null":
+        return None
+    return path[len(prefix):] if path.startswith(prefix) else path
+
+def _git_style_patch(patch_text: str) -> str:
+    """Add the `diff --git` (and new/deleted file mode) headers that libgit2
+    requires in front of each file of a plain unified diff."""
+    lines = patch_text.splitlines(keepends=True)
+    out = []
+    has_header = False
+    for i, ln in enumerate(lines):
+        if ln.startswith("diff --git "):
+            has_header = True
+        elif ln.startswith("--- ") and i + 1 < len(lines) and lines[i + 1].startswith("+++ "):
+            if not has_header:
+                old, new = _diff_path(ln, "a/"), _diff_path(lines[i + 1], "b/")
+                out.append(f"diff --git a/{old or new} b/{new or old}\n")
+                if old is None:
+                    out.append("new file mode 100644\n")
+                elif new is None:
+                    out.append("deleted file mode 100644\n")
+            has_header = False
+        out.append(ln)
+    return "".join(out)
+
+def _short_status(line: str) -> str:
+    # Render a porcelain v2 record in the familiar `git status --porcelain` form.
+    kind = line[0]
+    if kind in "?!":
+        return kind * 2 + line[1:]
+    fields = line.split(" ", {"1": 8, "2": 9, "u": 10}.get(kind, 1))
+    xy = fields[1].replace(".", " ")
+    path = fields[-1]
+    if kind == "2":
+        new_path, _, orig = path.partition("\t")
+        path = f"{orig} -> {new_path}"
+    return f"{xy} {path}"
+
+_SESSIONS: Dict[str, GitSession] = {}
+
+def git_session(repo: str) -> GitSession:
+    """Return the shared GitSession for `repo`, creating it on first use."""
+    sess = _SESSIONS.get(repo)
+    if sess is None:
+        sess = _SESSIONS.setdefault(repo, GitSession(repo))
+    return sess
+
+def ensure_git(repo: str) -> Tuple[str, List[str]]:
+    """Validate `repo` and return its (HEAD oid, status lines) from the same git call."""
+    oid, entries = git_session(repo).status()
+    if oid is None:
         raise RuntimeError(f"{repo} is not a git repository. Run 'git init && git add . && git commit -m init' first.")
+    return oid, entries
 
 def new_branch(repo: str, name: str):
-    run(f"git checkout -B {name}", cwd=repo)
+    code, out = git_session(repo).checkout_branch(name)
+    if code != 0:
+        raise RuntimeError(f"Could not check out branch {name}:\n{out}")
+
+def local_changes(repo: str) -> Tuple[Optional[str], List[str]]:
+    """Snapshot `repo`'s uncommitted work without touching it.
+
+    Returns (stash commit of the tracked changes, or None when there are none,
+    untracked non-ignored paths), for add_worktree to carry over.
+    """
+    sess = git_session(repo)
+    code, out = sess.git("stash", "create")
+    if code != 0:
+        raise RuntimeError(f"Could not snapshot local changes in {repo}:\n{out}")
+    _, untracked = sess.git("ls-files", "--others", "--exclude-standard", "-z")
+    return out.strip() or None, [p for p in untracked.split("\0") if p]
+
+def add_worktree(repo: str, path: str, branch: str, changes: Optional[Tuple[Optional[str], List[str]]] = None) -> str:
+    """Create a linked work tree at `path` on `branch` (reset to HEAD) and return `path`.
+
+    Each Best-of-N attempt gets its own work tree so attempts can run concurrently.
+    `changes` (from local_changes) are applied on top, so the attempt sees the
+    same uncommitted edits as the main checkout.
+    """
+    sess = git_session(repo)
+    remove_worktree(repo, path)  # left over from an earlier run
+    code, out = sess.add_worktree(path, branch)
+    if code != 0:
+        raise RuntimeError(f"Could not create work tree {path}:\n{out}")
+    if changes is not None:
+        stash, untracked = changes
+        if stash:
+            code, out = git_session(path).git("stash", "apply", stash)
+            if code != 0:
+                raise RuntimeError(f"Could not apply local changes to work tree {path}:\n{out}")
+        for rel in untracked:
+            dest = os.path.join(path, rel)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.copy2(os.path.join(repo, rel), dest)
+    return path
+
+def worktree_root(repo: str) -> str:
+    """Directory holding the Best-of-N attempt work trees of `repo`."""
+    return os.path.join(git_session(repo).common_dir(), "rb-worktrees")
+
+def remove_worktree(repo: str, path: str):
+    """Remove the work tree at `path`, if any, releasing the branch it holds."""
+    sess = git_session(repo)
+    if os.path.exists(path):
+        sess.remove_worktree(path)
+        shutil.rmtree(path, ignore_errors=True)
+    sess.git("worktree", "prune")
 
 def get_diff(repo: str) -> str:
-    code, out = run("git diff", cwd=repo)
-    return out
+    return git_session(repo).diff()
 
 def apply_patch(repo: str, patch_text: str) -> Tuple[bool, str]:
     if "NO_PATCH_NEEDED" in patch_text:
         return True, "No patch needed."
-    # Write patch to temp and apply
-    with tempfile.NamedTemporaryFile("w", delete=False, suffix=".patch") as f:
-        f.write(patch_text)
-        patch_path = f.name
-    code, out = run(f"git apply --reject --whitespace=nowarn {patch_path}", cwd=repo)
-    os.unlink(patch_path)
+    sess = git_session(repo)
+    applied = sess.apply_in_process(patch_text)
+    if applied is not None:
+        return True, applied
+    code, out = sess.apply(patch_text)
     return code == 0, out
 
 def summarize_repo_state(repo: str) -> str:
-    code, out = run("git status --porcelain", cwd=repo)
-    status = out.strip()
-    code, out = run("git log -1 --oneline", cwd=repo)
-    last = out.strip()
-    return f"STATUS:\n{status}\n\nLAST COMMIT:\n{last}"
+    oid, entries = ensure_git(repo)
+    status = "\n".join(entries)
+    return f"STATUS:\n{status}\n\nLAST COMMIT:\n{oid}"
 
 def build_system(retrieved: List[Dict]) -> str:
-    header = prompts.SYSTEM_MEMORY_HEADER
-    mem_block = ""
-    for i, m in enumerate(retrieved, 1):
-        mem_block += f"\n[Memory {i}] {m.get('title','').strip()}\n{m.get('content','').strip()}\n"
-    return header + ("\nRetrieved:\n" + mem_block if mem_block else "\n(No relevant memory retrieved.)")
+    parts = [prompts.SYSTEM_MEMORY_HEADER, "\nRetrieved:\n" if retrieved else "\n(No relevant memory retrieved.)"]
+    parts.extend(
+        f"\n[Memory {i}] {m.get('title','').strip()}\n{m.get('content','').strip()}\n"
+        for i, m in enumerate(retrieved, 1)
+    )
+    return "".join(parts)
 
-def build_user(issue_text: str, repo_state: str, test_cmd: str) -> str:
+def build_user(issue_text: str, repo_state: str, test_cmd: List[str]) -> str:
     return f"""Issue:\n{issue_text.strip()}\n\nRepo summary:\n{repo_state}\n\nTask:\nPropose a minimal code patch (unified diff) that resolves the issue and makes tests pass.\n- Only output the patch, nothing else.\n- If the repo needs additional tests or small refactors, include them.\n- Keep changes focused.\n"""
 
 def extract_patch(text: str) -> str:
     # Accept raw unified diff or code fence containing it.
-    m = re.search(r"```(?:diff|patch)?\n(.*?)\n```", text, re.DOTALL)
+    m = _PATCH_RE.search(text)
     patch = m.group(1).strip() if m else text.strip()
-    # Validate basic unified diff markers
-    if "--- " in patch and "+++ " in patch and "@@ " in patch:
-        return patch
-    return patch  # let git apply validate
+    # No validation here: apply_patch reports malformed diffs. git apply rejects
+    # a patch whose last line is unterminated, so restore the newline strip() ate.
+    return patch + "\n" if patch else patch
+
+_SKIP_DIRS = {"node_modules", "__pycache__", "venv", "env", "build", "dist"}
 
-def label_success_from_tests(repo: str, test_cmd: str, timeout: int = 600) -> Tuple[bool, str]:
-    code, out = run(test_cmd, cwd=repo, timeout=timeout)
+def _is_test_file(name: str) -> bool:
+    return name.endswith(".py") and (name.startswith("test_") or name.endswith("_test.py"))
+
+def select_tests(repo: str, changed: List[str]) -> Optional[List[str]]:
+    """Map changed paths to the pytest files that cover them.
+
+    Changed test files are selected directly; a changed module `foo.py` selects
+    every `test_foo.py` / `foo_test.py` in the repo. Returns None (run the full
+    suite) when nothing changed or any change can't be mapped, e.g. non-Python
+    files or a module without a matching test file.
+    """
+    if not changed:
+        return None
+    tests_by_name: Dict[str, List[str]] = {}
+    for root, dirs, files in os.walk(repo):
+        dirs[:] = [d for d in dirs if not d.startswith(".") and d not in _SKIP_DIRS]
+        for name in files:
+            if _is_test_file(name):
+                tests_by_name.setdefault(name, []).append(os.path.relpath(os.path.join(root, name), repo))
+    selected = []
+    for path in changed:
+        name = os.path.basename(path)
+        if not name.endswith(".py"):
+            return None
+        if _is_test_file(name):
+            if os.path.exists(os.path.join(repo, path)):
+                selected.append(path)
+            continue
+        stem = name[:-3]
+        matches = tests_by_name.get(f"test_{stem}.py", []) + tests_by_name.get(f"{stem}_test.py", [])
+        if not matches:
+            return None
+        selected.extend(matches)
+    return sorted(set(selected))
+
+def _narrowable_pytest(repo: str, test_cmd: List[str]) -> bool:
+    # Plain `pytest ...` / `python -m pytest ...` that doesn't already name paths.
+    if os.path.basename(test_cmd[0]) in ("pytest", "py.test"):
+        args = test_cmd[1:]
+    elif test_cmd[1:3] == ["-m", "pytest"]:
+        args = test_cmd[3:]
+    else:
+        return False
+    return not any(os.path.exists(os.path.join(repo, a)) for a in args if not a.startswith("-"))
+
+def label_success_from_tests(repo: str, test_cmd: List[str], timeout: int = 600, incremental: bool = False) -> Tuple[bool, str]:
+    """Run the test command; with `incremental`, a pytest command only runs the
+    test files covering the work tree's changes (see select_tests)."""
+    argv = test_cmd
+    if incremental and test_cmd and _narrowable_pytest(repo, test_cmd):
+        selected = select_tests(repo, git_session(repo).changed_paths())
+        if selected:
+            argv = test_cmd + selected
+    code, out = run(argv, cwd=repo, timeout=timeout)
     return code == 0, out
 
 def judge_with_llm(llm: LLM, issue: str, traj: str, repo_summary: str) -> Tuple[bool, str]:
-    user = f"Issue:\n{issue}\n\nTrajectory:\n{traj}\n\nFinal repo summary:\n{repo_summary}"
-    out = llm.complete(system="You are a strict CI judge.", user=prompts.JUDGE_PROMPT + "\n\n" + user)
+    user = "\n\n".join([
+        prompts.JUDGE_PROMPT,
+        f"Issue:\n{issue}",
+        f"Trajectory:\n{traj}",
+        f"Final repo summary:\n{repo_summary}",
+    ])
+    out = llm.complete(system="You are a strict CI judge.", user=user)
     status_line = [ln for ln in out.splitlines() if ln.lower().startswith("status:")]
     status = status_line[0].split(":",1)[1].strip().lower() if status_line else "failure"
     return status == "success", out
 
 def extract_memory(llm: LLM, issue: str, traj: str, outcome: str) -> List[MemoryItem]:
     prompt = prompts.EXTRACT_SUCCESS_PROMPT if outcome == "success" else prompts.EXTRACT_FAILURE_PROMPT
-    out = llm.complete(system="Distill reusable coding strategies as memory.", user=prompt + f"\n\nIssue:\n{issue}\n\nTrajectory:\n{traj}")
+    user = "\n\n".join([prompt, f"Issue:\n{issue}", f"Trajectory:\n{traj}"])
+    out = llm.complete(system="Distill reusable coding strategies as memory.", user=user)
     items = []
-    blocks = re.split(r"(?m)^# Memory Item .*?$", out)
+    now = time.time()  # one timestamp for the whole batch
+    blocks = _MEMITEM_SPLIT.split(out)
     # naive parse: look for Title/Description/Content
     for blk in blocks:
-        t = re.search(r"##\s*Title\s*(.+)", blk)
-        d = re.search(r"##\s*Description\s*(.+)", blk)
-        c = re.search(r"##\s*Content\s*(.+)", blk, re.DOTALL)
+        t = _TITLE_RE.search(blk)
+        d = _DESC_RE.search(blk)
+        c = _CONTENT_RE.search(blk)
         if t and d and c:
             items.append(MemoryItem(
                 title=t.group(1).strip(),
                 description=d.group(1).strip(),
                 content=c.group(1).strip(),
                 outcome=outcome,
-                created_at=time.time(),
+                created_at=now,
                 source={"type":"code", "notes":"rb-run"}
             ))
     return items[:3]
 
-def attempt_once(repo: str, issue_text: str, test_cmd: str, llm: LLM, store: MemoryStore, branch: str, self_refine_rounds: int = 0) -> Dict:
-    ensure_git(repo)
+def has_similar_success(store: MemoryStore, issue_text: str, threshold: float = MEMORY_DEDUP_THRESHOLD) -> bool:
+    return any(
+        score is not None and score >= threshold
+        for _, score in store.search_with_scores(issue_text, top_k=1, outcome="success")
+    )
+
+def _skipped(branch: str, retrieved: List[Dict], traj: List[str]) -> Dict:
+    log = "SKIPPED: another attempt already succeeded.\n"
+    return {
+        "branch": branch,
+        "success": False,
+        "skipped": True,
+        "test_log": log,
+        "traj_log": "".join(traj) + log,
+        "retrieved": retrieved,
+        "memory_added": [],
+    }
+
+def attempt_once(repo: str, issue_text: str, test_cmd: List[str], llm: LLM, store: MemoryStore, branch: str, self_refine_rounds: int = 0, incremental_tests: bool = False, retrieved: Optional[List[Dict]] = None, stop: Optional[threading.Event] = None) -> Dict:
+    """Run one attempt on `branch`. `retrieved` is the memory to condition on; when
+    None it is looked up in `store` (runner.py looks it up once for all attempts).
+
+    `stop` is shared by parallel attempts and set by the first to succeed; the
+    others then skip their remaining LLM calls and test run.
+    """
+    # Doubles as the git-repo check; `checkout -B` below keeps HEAD and the tree as-is.
+    repo_state = summarize_repo_state(repo)
     new_branch(repo, branch)
 
-    retrieved = store.search(issue_text, top_k=1)
+    if retrieved is None:
+        retrieved = store.search(issue_text, top_k=1)
+    if stop is not None and stop.is_set():
+        return _skipped(branch, retrieved, [])
     system = build_system(retrieved)
-    user = build_user(issue_text, summarize_repo_state(repo), test_cmd)
+    user = build_user(issue_text, repo_state, test_cmd)
     model_out = llm.complete(system=system, user=user)
     patch = extract_patch(model_out)
     ok_apply, apply_out = apply_patch(repo, patch)
-    traj_log = f"SYSTEM:\n{system}\n\nUSER:\n{user}\n\nMODEL_OUT:\n{model_out}\n\nPATCH_APPLY_OK={ok_apply}\nAPPLY_LOG:\n{apply_out}\n"
+    # Trajectory pieces, joined once after the tests run.
+    traj = [f"SYSTEM:\n{system}\n\nUSER:\n{user}\n\nMODEL_OUT:\n{model_out}\n\nPATCH_APPLY_OK={ok_apply}\nAPPLY_LOG:\n{apply_out}\n"]
 
     if not ok_apply:
         # try once with small refine
@@ -115,20 +414,31 @@ def attempt_once(repo: str, issue_text: str, test_cmd: str, llm: LLM, store: Mem
             refine = llm.complete(system="Self-refine", user=prompts.SEQUENTIAL_REFINE_INSTRUCTION_1 + f"\n\nPrevious patch apply failed:\n{apply_out}\n\nReprint a corrected unified diff.")
             patch2 = extract_patch(refine)
             ok_apply, apply_out2 = apply_patch(repo, patch2)
-            traj_log += f"\nREFINE1_OUT:\n{refine}\nPATCH_APPLY_OK={ok_apply}\nAPPLY_LOG:\n{apply_out2}\n"
+            traj.append(f"\nREFINE1_OUT:\n{refine}\nPATCH_APPLY_OK={ok_apply}\nAPPLY_LOG:\n{apply_out2}\n")
 
+    if stop is not None and stop.is_set():
+        return _skipped(branch, retrieved, traj)
     # run tests
-    success, test_log = label_success_from_tests(repo, test_cmd)
-    traj_log += f"\nTEST_SUCCESS={success}\nTEST_LOG:\n{test_log}\n"
+    success, test_log = label_success_from_tests(repo, test_cmd, incremental=incremental_tests)
+    traj.append(f"\nTEST_SUCCESS={success}\nTEST_LOG:\n{test_log}\n")
+    traj_log = "".join(traj)
+    # Another attempt finished first while these tests ran.
+    superseded = stop is not None and stop.is_set()
+    if success and stop is not None:
+        stop.set()
 
-    # extract memory
+    # extract memory, unless a success here would only repeat what's already stored
     outcome = "success" if success else "failure"
-    items = extract_memory(llm, issue_text, traj_log, outcome)
-    store.add_items(items)
+    if superseded or (success and has_similar_success(store, issue_text)):
+        items = []
+    else:
+        items = extract_memory(llm, issue_text, traj_log, outcome)
+        store.add_items(items)
 
     return {
         "branch": branch,
         "success": success,
+        "skipped": False,
         "test_log": test_log,
         "traj_log": traj_log,
         "retrieved": retrieved,
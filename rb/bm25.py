@@ -0,0 +1,98 @@
+"""
+BM25 lexical index, used by the JSONL memory store when scikit-learn is not
+installed.
+
+Documents are tokenized once when added and kept as a growing CSR matrix of
+term frequencies (indptr / term ids / counts). Document frequencies and the
+average length are maintained incrementally, so adding documents never needs a
+refit. Scoring is one pass over the postings: a numba kernel when numba is
+installed, vectorized NumPy otherwise.
+"""
+import re
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+_TOKEN_RE = re.compile(r"(?u)\b\w\w+\b")  # same tokens as sklearn's default
+
+K1 = 1.2
+B = 0.75
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit, prange = None, range
+
+def _scan(indptr, indices, tf, qidf, dl, avgdl, scores):
+    for d in prange(len(indptr) - 1):
+        norm = K1 * (1.0 - B + B * dl[d] / avgdl)
+        s = 0.0
+        for p in range(indptr[d], indptr[d + 1]):
+            w = qidf[indices[p]]
+            if w != 0.0:
+                s += w * tf[p] * (K1 + 1.0) / (tf[p] + norm)
+        scores[d] = s
+
+# Documents are scored in parallel threads; compiled on first use and cached on disk.
+_scan_jit = njit(cache=True, parallel=True)(_scan) if njit is not None else None
+
+class BM25Index:
+    def __init__(self):
+        self._vocab: Dict[str, int] = {}
+        self._df: List[int] = []
+        self._indptr: List[int] = [0]
+        self._indices: List[int] = []
+        self._tf: List[float] = []
+        self._dl: List[int] = []
+        self._arrays = None  # NumPy views of the lists above, rebuilt after adds
+
+    def __len__(self) -> int:
+        return len(self._dl)
+
+    def add(self, docs: Iterable[str]) -> None:
+        for doc in docs:
+            counts: Dict[int, int] = {}
+            for tok in _TOKEN_RE.findall(doc.lower()):
+                tid = self._vocab.setdefault(tok, len(self._vocab))
+                counts[tid] = counts.get(tid, 0) + 1
+            for tid in counts:
+                if tid == len(self._df):
+                    self._df.append(0)
+                self._df[tid] += 1
+            self._indices.extend(counts)
+            self._tf.extend(counts.values())
+            self._indptr.append(len(self._indices))
+            self._dl.append(sum(counts.values()))
+        self._arrays = None
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every document for `query` (0 for documents without a query term)."""
+        n = len(self)
+        out = np.zeros(n, dtype=np.float64)
+        qids = {self._vocab[t] for t in _TOKEN_RE.findall(query.lower()) if t in self._vocab}
+        if not qids:
+            return out
+        if self._arrays is None:
+            self._arrays = (
+                np.asarray(self._indptr, dtype=np.int64),
+                np.asarray(self._indices, dtype=np.int32),
+                np.asarray(self._tf, dtype=np.float64),
+                np.asarray(self._dl, dtype=np.float64),
+                np.asarray(self._df, dtype=np.float64),
+            )
+        indptr, indices, tf, dl, df = self._arrays
+        avgdl = max(dl.mean(), 1.0)
+        qidf = np.zeros(len(df), dtype=np.float64)
+        q = np.fromiter(qids, dtype=np.int64)
+        qidf[q] = np.log1p((n - df[q] + 0.5) / (df[q] + 0.5))
+        if _scan_jit is not None:
+            _scan_jit(indptr, indices, tf, qidf, dl, avgdl, out)
+            return out
+        # Only postings of query terms contribute.
+        w = qidf[indices]
+        hit = np.flatnonzero(w)
+        rows = np.searchsorted(indptr, hit, side="right") - 1
+        t = tf[hit]
+        norm = K1 * (1.0 - B + B * dl[rows] / avgdl)
+        np.add.at(out, rows, w[hit] * t * (K1 + 1.0) / (t + norm))
+        return out
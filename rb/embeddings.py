@@ -0,0 +1,61 @@
+"""
+Optional local sentence embeddings.
+
+Uses sentence-transformers (default model all-MiniLM-L6-v2, 384-d) and is only
+imported when a feature that needs embeddings is enabled.
+Set RB_EMBED_MODEL to use a different model.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import List
+
+import numpy as np
+
+DEFAULT_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+_model = None
+_model_lock = threading.Lock()
+
+# Recent query embeddings, keyed by a digest of the text so long prompts are not
+# kept alive as keys. Oldest first.
+QUERY_CACHE_SIZE = 1024
+_query_cache: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+_query_lock = threading.Lock()
+
+def _get_model():
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                try:
+                    from sentence_transformers import SentenceTransformer
+                except ImportError as e:
+                    raise RuntimeError("Embeddings require the sentence-transformers package (pip install sentence-transformers).") from e
+                _model = SentenceTransformer(os.getenv("RB_EMBED_MODEL", DEFAULT_MODEL))
+    return _model
+
+def embed(texts: List[str]) -> np.ndarray:
+    """Embed `texts` as L2-normalized float32 rows, so dot products are cosine similarities."""
+    vecs = _get_model().encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+    return np.asarray(vecs, dtype=np.float32)
+
+def embed_query(text: str) -> np.ndarray:
+    """Embed a single query, reusing the result for recently seen texts.
+
+    The returned array is shared between callers and therefore read-only.
+    """
+    key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+    with _query_lock:
+        vec = _query_cache.get(key)
+        if vec is not None:
+            _query_cache.move_to_end(key)
+            return vec
+    vec = embed([text])[0]
+    vec.setflags(write=False)
+    with _query_lock:
+        _query_cache[key] = vec
+        if len(_query_cache) > QUERY_CACHE_SIZE:
+            _query_cache.popitem(last=False)
+    return vec
@@ -5,19 +5,31 @@ Uses Graphiti's temporal knowledge graph for storing and retrieving memory items
 Set env var RB_STORE=graphiti and configure GRAPHITI_URI, GRAPHITI_USER, GRAPHITI_PASSWORD.
 """
 import os
+import asyncio
+import threading
 from typing import List, Dict, Any
 from datetime import datetime
-from graphiti_core import Graphiti
-from graphiti_core.nodes import EpisodeType
-import nest_asyncio
 
-# Allow nested event loops (needed for sync interface over async library)
-nest_asyncio.apply()
+# Episodes per add_episode_bulk call. Graphiti extracts, dedupes and saves a
+# batch together (batched Neo4j writes instead of per-episode ones); its LLM
+# calls grow with the batch, so large upserts are split.
+EPISODE_BATCH_SIZE = 20
 
-import asyncio
+# Indexes on top of Graphiti's own. Before adding episodes Graphiti loads the
+# group's latest ones (group_id equality, valid_at range, ordered by valid_at);
+# its indexes cover each property alone, this composite serves the whole lookup.
+EXTRA_INDEXES = [
+    "CREATE INDEX rb_episodic_group_valid_at IF NOT EXISTS FOR (n:Episodic) ON (n.group_id, n.valid_at)",
+]
 
 class GraphitiClient:
     def __init__(self):
+        # Imported here so graphiti_core is only loaded when RB_STORE=graphiti.
+        try:
+            from graphiti_core import Graphiti
+        except ImportError as e:
+            raise RuntimeError("RB_STORE=graphiti requires the graphiti-core package (pip install graphiti-core).") from e
+
         self.uri = os.getenv("GRAPHITI_URI", "bolt://localhost:7687")
         self.user = os.getenv("GRAPHITI_USER", "neo4j")
         self.password = os.getenv("GRAPHITI_PASSWORD", "")
@@ -47,11 +59,25 @@ class GraphitiClient:
         # Setup will be done lazily on first use
         self._setup_done = False
 
+        # One event loop for the client's lifetime, so the Neo4j driver and HTTP
+        # connection pools survive across calls instead of being torn down by
+        # asyncio.run each time. The lock keeps threads (parallel attempts) from
+        # driving the loop concurrently.
+        self._loop = asyncio.new_event_loop()
+        self._loop_lock = threading.Lock()
+
+    def _run(self, coro):
+        """Run a coroutine to completion on the client's event loop."""
+        with self._loop_lock:
+            return self._loop.run_until_complete(coro)
+
     async def _ensure_setup(self):
         """Ensure database indices and constraints are set up."""
         if not self._setup_done:
             try:
                 await self.graphiti.build_indices_and_constraints()
+                for query in EXTRA_INDEXES:
+                    await self.graphiti.driver.execute_query(query)
                 self._setup_done = True
             except Exception:
                 # May already exist, that's OK
@@ -62,13 +88,16 @@ class GraphitiClient:
         Store memory items as episodes in Graphiti.
         Each memory item becomes an episode with its content.
         """
-        # Use asyncio.run which handles event loop creation/cleanup
-        asyncio.run(self._upsert_memory_items_async(items))
+        self._run(self._upsert_memory_items_async(items))
 
     async def _upsert_memory_items_async(self, items: List[Dict[str, Any]]) -> None:
+        from graphiti_core.nodes import EpisodeType
+        from graphiti_core.utils.bulk_utils import RawEpisode
+
         # Ensure setup is done first
         await self._ensure_setup()
 
+        episodes = []
         for item in items:
             # Convert memory item to episode
             title = item.get("title", "Untitled Memory")
@@ -77,28 +106,25 @@ class GraphitiClient:
             outcome = item.get("outcome", "unknown")
             created_at = item.get("created_at", datetime.now().timestamp())
 
-            # Combine description and content into episode body
-            episode_body = f"{description}\n\n{content}"
-
-            # Add metadata about outcome
-            source_description = f"ReasoningBank memory ({outcome})"
-
-            await self.graphiti.add_episode(
+            episodes.append(RawEpisode(
                 name=title,
-                episode_body=episode_body,
-                source_description=source_description,
-                reference_time=datetime.fromtimestamp(created_at),
+                # Combine description and content into episode body
+                content=f"{description}\n\n{content}",
+                # Add metadata about outcome
+                source_description=f"ReasoningBank memory ({outcome})",
                 source=EpisodeType.text,
-                group_id="reasoning_bank"
-            )
+                reference_time=datetime.fromtimestamp(created_at),
+            ))
+
+        for i in range(0, len(episodes), EPISODE_BATCH_SIZE):
+            await self.graphiti.add_episode_bulk(episodes[i:i + EPISODE_BATCH_SIZE], group_id="reasoning_bank")
 
     def search(self, query: str, top_k: int = 1) -> List[Dict[str, Any]]:
         """
         Search memory items using Graphiti's hybrid search.
         Returns top_k relevant memory items.
         """
-        # Use asyncio.run which handles event loop creation/cleanup
-        return asyncio.run(self._search_async(query, top_k))
+        return self._run(self._search_async(query, top_k))
 
     async def _search_async(self, query: str, top_k: int) -> List[Dict[str, Any]]:
         # Use Graphiti's hybrid search on edges (facts)
@@ -124,5 +150,6 @@ class GraphitiClient:
         return results
 
     def close(self):
-        """Close the Graphiti connection."""
-        asyncio.run(self.graphiti.close())
+        """Close the Graphiti connection and the client's event loop."""
+        self._run(self.graphiti.close())
+        self._loop.close()
@@ -4,16 +4,41 @@ from tenacity import retry, stop_after_attempt, wait_exponential
 
 # Provider-agnostic wrapper (Anthropic first, OpenAI fallback).
 
+def _http_client(sdk):
+    """The SDK's default pooled keep-alive client, speaking HTTP/2 when `h2` is installed.
+
+    One LLM (and so one connection pool) is shared by every attempt in runner.py.
+    """
+    try:
+        import h2  # noqa: F401  (httpx's optional HTTP/2 support)
+    except ImportError:
+        return sdk.DefaultHttpxClient()
+    return sdk.DefaultHttpxClient(http2=True)
+
 class LLM:
-    def __init__(self, model: Optional[str] = None, provider: Optional[str] = None, max_tokens: int = 2000):
+    def __init__(self, model: Optional[str] = None, provider: Optional[str] = None, max_tokens: int = 2000, cache: Optional[str] = None):
         self.provider = provider or os.getenv("RB_LLM_PROVIDER", "anthropic")
         self.model = model or os.getenv("RB_MODEL", "")
         self.max_tokens = max_tokens
 
+        # Completion cache is off by default: Best-of-N relies on repeated identical
+        # prompts producing different samples.
+        cache_mode = (cache or os.getenv("RB_LLM_CACHE", "off")).lower()
+        if cache_mode in ("exact", "semantic"):
+            from .semantic_cache import SemanticCache
+            self.cache = SemanticCache(
+                semantic=cache_mode == "semantic",
+                threshold=float(os.getenv("RB_LLM_CACHE_THRESHOLD", "0.87")),
+            )
+        elif cache_mode == "off":
+            self.cache = None
+        else:
+            raise ValueError("Unknown cache mode. Set RB_LLM_CACHE to 'off', 'exact' or 'semantic'.")
+
         if self.provider == "anthropic":
             try:
-                from anthropic import Anthropic
-                self.client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+                import anthropic
+                self.client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"), http_client=_http_client(anthropic))
                 if not self.model:
                     # leave model unspecified so user can set; default commonly available model
                     self.model = os.getenv("RB_MODEL", "claude-3-5-sonnet-latest")
@@ -21,8 +46,8 @@ class LLM:
                 raise RuntimeError("Anthropic selected but anthropic package not available or API key missing.") from e
         elif self.provider == "openai":
             try:
-                from openai import OpenAI
-                self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+                import openai
+                self.client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=_http_client(openai))
                 if not self.model:
                     self.model = os.getenv("RB_MODEL", "gpt-4o-mini")
             except Exception as e:
@@ -30,8 +55,13 @@ class LLM:
         else:
             raise ValueError("Unknown provider. Set RB_LLM_PROVIDER to 'anthropic' or 'openai'.")
 
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
     def complete(self, system: str, user: str) -> str:
+        if self.cache is None:
+            return self._complete(system, user)
+        return self.cache.get_or_complete(system, user, self._complete)
+
+    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
+    def _complete(self, system: str, user: str) -> str:
         if self.provider == "anthropic":
             resp = self.client.messages.create(
                 model=self.model,
@@ -1,11 +1,35 @@
-import os, json, time, math
+import os, time, math, threading, mmap
 from dataclasses import dataclass, asdict
-from typing import List, Dict, Any, Tuple
-from collections import Counter
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from typing import TYPE_CHECKING, List, Dict, Any, Iterator, Optional, Tuple
+from array import array
+from collections import Counter, OrderedDict
+import numpy as np
+import orjson
 
-@dataclass
+from . import ranking
+
+if TYPE_CHECKING:
+    # sklearn (and scipy with it) is imported on first fit: it is slow to import
+    # and not needed by the Graphiti and FAISS backends.
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+# The cached TF-IDF index is refit once the docs added since the last fit reach
+# 10% of the corpus (so small stores always refit) or REFIT_EVERY, whichever is
+# smaller. In between, new docs reuse the fitted vocabulary/idf, which drift slowly.
+REFIT_EVERY = 64
+
+# Distinct (query, top_k, outcome) searches whose ranked row ids are kept until
+# the next add_items; agents re-issue the same query within a session.
+RESULT_CACHE_SIZE = 256
+
+# One JSONL line per record; orjson appends the newline itself, avoiding a copy.
+_JSONL_OPTS = orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE
+
+def _doc_text(d: Dict[str, Any]) -> str:
+    """Text a record is indexed by (title + content; add_items builds it inline)."""
+    return d["title"] + "\n" + d["content"]
+
+@dataclass(slots=True)
 class MemoryItem:
     title: str
     description: str
@@ -17,6 +41,10 @@ class MemoryItem:
 class MemoryStore:
     def __init__(self, path: str = "memory/memory.jsonl", use_graphiti: bool = False):
         self.use_graphiti = use_graphiti or os.getenv("RB_STORE") == "graphiti"
+        # RB_STORE=faiss keeps the JSONL file but ranks by embedding similarity.
+        self.use_faiss = not self.use_graphiti and os.getenv("RB_STORE") == "faiss"
+        # Serializes appends and index updates when attempts run in parallel threads.
+        self._lock = threading.Lock()
 
         if self.use_graphiti:
             from .graphiti_client import GraphitiClient
@@ -28,49 +56,270 @@ class MemoryStore:
                 os.makedirs(dirname, exist_ok=True)
             if not os.path.exists(self.path):
                 open(self.path, "a", encoding="utf-8").close()
+            # Records stay on disk: the file is mmapped on first search and only the
+            # byte span of each line is kept. Lines are decoded to build the index
+            # and again for returned results.
+            self._loaded = False
+            self._mm: Optional[mmap.mmap] = None
+            self._end = 0  # file offset up to which lines have been indexed
+            self._starts = array("q")
+            self._ends = array("q")
+            self._by_outcome: Dict[str, List[int]] = {}  # outcome -> row ids, ascending
+            # Search index (TF-IDF or vectors), kept in sync by add_items.
+            self._vectorizer: Optional["TfidfVectorizer"] = None
+            self._X = None
+            self._added_since_fit = 0
+            self._bm25 = None  # used instead of TF-IDF when scikit-learn is missing
+            self._vectors = None
+            self._results: "OrderedDict[Tuple[str, int, Optional[str]], List[Tuple[int, Optional[float]]]]" = OrderedDict()
+            if self.use_faiss:
+                from .vector_index import VectorIndex
+                self._vectors = VectorIndex(
+                    os.path.splitext(self.path)[0] + ".faiss",
+                    int8=os.getenv("RB_VECTOR_QUANT") == "int8",
+                )
 
     def add_items(self, items: List[MemoryItem]) -> None:
+        with self._lock:
+            self._add_items(items)
+
+    def _add_items(self, items: List[MemoryItem]) -> None:
         if self.use_graphiti:
             # Convert MemoryItems to dicts and store in Graphiti
             item_dicts = [asdict(it) for it in items]
             self.graphiti.upsert_memory_items(item_dicts)
+            return
+        # Store in JSONL. One pass over the items builds the write buffer and
+        # everything the index needs, so the new lines needn't be read back.
+        buf = bytearray()
+        spans, outcomes, docs = [], [], []
+        for it in items:
+            start = len(buf)
+            # orjson serializes the dataclass natively, ~10x faster than via asdict().
+            buf += orjson.dumps(it, option=_JSONL_OPTS)
+            spans.append((start, len(buf)))
+            outcomes.append(it.outcome)
+            docs.append(it.title + "\n" + it.content)
+        end = self._write(buf)
+        self._results.clear()
+        if not self._loaded or not items:
+            return
+        base = end - len(buf)
+        if base == self._end:
+            self._remap()
+            for (start, stop), outcome in zip(spans, outcomes):
+                self._add_record(base + start, base + stop, outcome)
+            self._end = end
         else:
-            # Store in JSONL
-            with open(self.path, "a", encoding="utf-8") as f:
-                for it in items:
-                    f.write(json.dumps(asdict(it), ensure_ascii=False) + "\n")
-
-    def _load(self) -> List[Dict[str, Any]]:
-        """Load from JSONL (only used when not using Graphiti)."""
-        out = []
-        with open(self.path, "r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    out.append(json.loads(line))
-                except json.JSONDecodeError:
-                    continue
-        return out
-
-    def search(self, query: str, top_k: int = 1) -> List[Dict[str, Any]]:
-        """Search using Graphiti (hybrid) or TF-IDF (lexical)."""
+            # Another process appended in between; index its lines too, in file order.
+            docs = self._scan()
+        self._index(docs)
+
+    def _index(self, docs: List[str]) -> None:
+        """Add the just-recorded records (`docs` is their index text) to the search index."""
+        if self.use_faiss:
+            self._sync_vectors(docs)
+            return
+        if self._bm25 is not None:
+            self._bm25.add(docs)
+            return
+        self._added_since_fit += len(docs)
+        refit_at = min(REFIT_EVERY, max(1, len(self._starts) // 10))
+        if self._vectorizer is None or self._added_since_fit >= refit_at:
+            self._fit()
+        elif docs:
+            import scipy.sparse
+            new_X = self._vectorizer.transform(docs)
+            self._X = scipy.sparse.vstack([self._X, new_X], format="csc")
+
+    def _write(self, buf: bytes) -> int:
+        """Append `buf` to the JSONL file as one O_APPEND write, so a batch lands
+        contiguously; returns the file offset just past it."""
+        view = memoryview(buf)
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            while view:
+                view = view[os.write(fd, view):]
+            return os.lseek(fd, 0, os.SEEK_CUR)
+        finally:
+            os.close(fd)
+
+    def _remap(self) -> None:
+        if self._mm is not None:
+            self._mm.close()
+        with open(self.path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _add_record(self, start: int, end: int, outcome: Optional[str]) -> None:
+        self._by_outcome.setdefault(outcome, []).append(len(self._starts))
+        self._starts.append(start)
+        self._ends.append(end)
+
+    def _scan(self) -> List[str]:
+        """Index the lines appended to the file since the last scan (all of it on the
+        first call), remapping it; returns the index text of the new records."""
+        size = os.path.getsize(self.path)
+        if size <= self._end:
+            return []  # also avoids mmapping an empty file, which mmap refuses
+        self._remap()
+        self._mm.seek(self._end)
+        docs, pos = [], self._end
+        for line in iter(self._mm.readline, b""):
+            start, pos = pos, pos + len(line)
+            if line.isspace():
+                continue
+            try:
+                d = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                continue
+            self._add_record(start, pos, d.get("outcome"))
+            docs.append(_doc_text(d))
+        self._end = pos
+        return docs
+
+    def _row(self, i: int) -> Dict[str, Any]:
+        return orjson.loads(self._mm[self._starts[i]:self._ends[i]])
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        docs = self._scan()
+        self._loaded = True
+        if self.use_faiss:
+            self._sync_vectors()
+        else:
+            self._fit(docs)
+
+    def _docs(self, start: int = 0) -> Iterator[str]:
+        """Index text of records `start:`, decoded from the file."""
+        return (_doc_text(self._row(i)) for i in range(start, len(self._starts)))
+
+    def _fit(self, docs: Optional[List[str]] = None) -> None:
+        """(Re)fit the TF-IDF vectorizer and doc matrix over everything loaded.
+
+        `docs` is the index text of all records, when the caller already has it.
+        """
+        self._added_since_fit = 0
+        self._vectorizer, self._X = None, None
+        if not self._starts:
+            return
+        if docs is None:
+            docs = list(self._docs())
+        try:
+            from sklearn.feature_extraction.text import TfidfVectorizer
+        except ImportError:
+            # BM25 keeps its statistics up to date as docs are added; no refits.
+            from .bm25 import BM25Index
+            self._bm25 = BM25Index()
+            self._bm25.add(docs)
+            return
+        vect = TfidfVectorizer(stop_words="english", max_features=20000)
+        try:
+            # Term-major (CSC), so a query only reads the postings of its own terms.
+            self._X = vect.fit_transform(docs).tocsc()
+        except ValueError:
+            # Empty vocabulary (stop words only); refit on the next add.
+            return
+        self._vectorizer = vect
+
+    def _sync_vectors(self, new_docs: Optional[List[str]] = None) -> None:
+        """Embed loaded records the vector index does not have yet, then persist it.
+
+        `new_docs` is the index text of the last records, when the caller has it.
+        """
+        from .embeddings import embed
+        if len(self._vectors) > len(self._starts):
+            self._vectors.reset()
+        missing = len(self._starts) - len(self._vectors)
+        if missing == 0:
+            return
+        vecs = embed(new_docs if new_docs is not None and len(new_docs) == missing else list(self._docs(len(self._vectors))))
+        if self._vectors.dim not in (None, vecs.shape[1]):
+            # Embedding model changed since the index was written; re-embed everything.
+            self._vectors.reset()
+            vecs = embed(list(self._docs()))
+        self._vectors.add(vecs)
+        self._vectors.save()
+
+    def search(self, query: str, top_k: int = 1, outcome: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Search using Graphiti (hybrid), FAISS (embeddings) or TF-IDF / BM25 (lexical).
+
+        With `outcome` ("success" or "failure"), only memories with that outcome are
+        ranked. Graphiti has no outcome to filter on before ranking, so its results
+        are filtered afterwards.
+        """
+        return [item for item, _ in self.search_with_scores(query, top_k, outcome)]
+
+    def search_with_scores(self, query: str, top_k: int = 1, outcome: Optional[str] = None) -> List[Tuple[Dict[str, Any], Optional[float]]]:
+        """Like search, but pairs each item with its cosine similarity to the query.
+
+        Scores are None for Graphiti, which does not expose them, and for the BM25
+        fallback, whose scores are not similarities.
+        """
+        with self._lock:
+            return self._search(query, top_k, outcome)
+
+    def _search(self, query: str, top_k: int, outcome: Optional[str]) -> List[Tuple[Dict[str, Any], Optional[float]]]:
         if self.use_graphiti:
-            return self.graphiti.search(query, top_k)
+            items = self.graphiti.search(query, top_k)
+            return [(item, None) for item in items if outcome is None or item.get("outcome") == outcome]
+        # Only the local backends are cached: other writers share a Graphiti graph.
+        key = (query, top_k, outcome)
+        ranked = self._results.get(key)
+        if ranked is None:
+            ranked = self._rank(query, top_k, outcome)
+            self._results[key] = ranked
+            if len(self._results) > RESULT_CACHE_SIZE:
+                self._results.popitem(last=False)
+        else:
+            self._results.move_to_end(key)
+        return [(self._row(i), score) for i, score in ranked]
+
+    def _rank(self, query: str, top_k: int, outcome: Optional[str]) -> List[Tuple[int, Optional[float]]]:
+        """(row id, score) of the `top_k` best matches, best first."""
+        self._ensure_loaded()
+        # Candidate row ids, or None for all rows.
+        rows = None if outcome is None else np.asarray(self._by_outcome.get(outcome, []), dtype=np.int64)
+        n = len(self._starts) if rows is None else len(rows)
+        if n == 0 or top_k <= 0:
+            return []
+        if self.use_faiss:
+            from .embeddings import embed_query
+            scores, ids = self._vectors.search(embed_query(query), top_k, rows)
+            return [(int(i), float(sc)) for i, sc in zip(ids, scores) if i >= 0]
         else:
-            # Simple lexical retrieval using TF‑IDF over title+content
-            data = self._load()
-            if not data:
-                return []
-            docs = [d["title"] + "\n" + d["content"] for d in data]
-            vect = TfidfVectorizer(stop_words="english", max_features=20000)
-            X = vect.fit_transform(docs + [query])
-            sims = cosine_similarity(X[:-1], X[-1])
-            ranked = sorted(zip(range(len(data)), sims.flatten()), key=lambda x: x[1], reverse=True)[:top_k]
-            return [data[i] for (i, _) in ranked]
+            # Simple lexical retrieval using TF‑IDF (or BM25 without scikit-learn) over title+content
+            if self._bm25 is not None:
+                sims = self._bm25.scores(query)
+            elif self._vectorizer is None:
+                top = range(min(top_k, n))
+                return [(i if rows is None else int(rows[i]), 0.0) for i in top]
+            else:
+                # Rows are L2-normalized, so the dot product is the cosine similarity.
+                qv = self._vectorizer.transform([query])
+                sims = self._X[:, qv.indices] @ qv.data
+            if rows is not None:
+                sims = sims[rows]  # positions below index into `rows`
+            # Rank only docs sharing a term with the query...
+            hits = np.flatnonzero(sims)
+            top = hits[ranking.top_k(sims[hits], top_k)].tolist()
+            if len(top) < top_k:
+                # ...then pad with the remaining docs in insertion order, as a full ranking would.
+                matched = set(top)
+                top.extend(i for i in range(min(n, top_k + len(hits))) if i not in matched)
+                top = top[:top_k]
+            ids = top if rows is None else rows[top].tolist()
+            if self._bm25 is not None:
+                return [(i, None) for i in ids]
+            return [(i, float(sims[p])) for i, p in zip(ids, top)]
 
     def close(self):
-        """Close connections (only needed for Graphiti)."""
+        """Close connections (Graphiti) or the mapped JSONL file."""
         if self.use_graphiti:
             self.graphiti.close()
+        elif self._mm is not None:
+            self._mm.close()
+            self._mm = None
+            self._results.clear()
+            self._loaded, self._end = False, 0
+            self._starts, self._ends, self._by_outcome = array("q"), array("q"), {}
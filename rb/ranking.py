@@ -0,0 +1,11 @@
+"""
+Ranking helpers shared by the memory store's lexical and vector search.
+"""
+import numpy as np
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the `k` highest scores, best first; ties keep position order."""
+    pos = np.arange(len(scores))
+    if k < len(scores):
+        pos = np.argpartition(-scores, k - 1)[:k]
+    return pos[np.lexsort((pos, -scores[pos]))]
@@ -0,0 +1,95 @@
+"""
+Completion cache for LLM.complete.
+
+Exact repeats are keyed by sha256 of (system, user). In semantic mode a miss is
+also compared against cached prompts that share the same system message, by
+embedding cosine similarity of the user message, and served when the best match
+reaches the threshold. Entries are evicted least-recently-used.
+
+Note the embedding model truncates long inputs (~256 word pieces for MiniLM), so
+prompts that only differ far into the user message can match each other.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+class SemanticCache:
+    def __init__(self, semantic: bool = True, threshold: float = 0.87, max_entries: int = 1024):
+        self.semantic = semantic
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # prompt key -> (embedding slot or -1, response), oldest first
+        self._entries: "OrderedDict[str, Tuple[int, str]]" = OrderedDict()
+        # Fixed-size embedding matrix; a slot is freed on eviction and reused.
+        self._mat: Optional[np.ndarray] = None
+        self._slot_key = [""] * max_entries
+        self._slot_group = np.full(max_entries, -1, dtype=np.int64)
+        self._groups: Dict[str, int] = {}
+        self._free = list(range(max_entries - 1, -1, -1))
+
+    @staticmethod
+    def _digest(*parts: str) -> str:
+        h = hashlib.sha256()
+        for p in parts:
+            h.update(p.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def get_or_complete(self, system: str, user: str, complete: Callable[[str, str], str]) -> str:
+        """Return a cached response for the prompt, or call `complete` and cache its result."""
+        key = self._digest(system, user)
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit is not None:
+                self._entries.move_to_end(key)
+                return hit[1]
+
+        q, group = None, -1
+        if self.semantic:
+            from .embeddings import embed_query
+            q = embed_query(user)
+            with self._lock:
+                group = self._groups.setdefault(self._digest(system), len(self._groups))
+                cached = self._nearest(q, group)
+            if cached is not None:
+                return cached
+
+        response = complete(system, user)
+        with self._lock:
+            self._put(key, q, group, response)
+        return response
+
+    def _nearest(self, q: np.ndarray, group: int) -> Optional[str]:
+        if self._mat is None:
+            return None
+        sims = self._mat @ q
+        sims[self._slot_group != group] = -np.inf
+        best = int(np.argmax(sims))
+        if sims[best] < self.threshold:
+            return None
+        key = self._slot_key[best]
+        self._entries.move_to_end(key)
+        return self._entries[key][1]
+
+    def _put(self, key: str, q: Optional[np.ndarray], group: int, response: str) -> None:
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+        if len(self._entries) >= self.max_entries:
+            slot, _ = self._entries.popitem(last=False)[1]
+            if slot >= 0:
+                self._slot_group[slot] = -1
+                self._free.append(slot)
+        slot = -1
+        if q is not None:
+            if self._mat is None:
+                self._mat = np.zeros((self.max_entries, q.shape[0]), dtype=np.float32)
+            slot = self._free.pop()
+            self._mat[slot] = q
+            self._slot_key[slot] = key
+            self._slot_group[slot] = group
+        self._entries[key] = (slot, response)
@@ -1,18 +1,24 @@
 #!/usr/bin/env python
-import argparse, os, json, time
+import argparse, os, json, time, shlex, threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from rb.llm import LLM
 from rb.memory_store import MemoryStore
-from rb.agent import attempt_once, run, new_branch, ensure_git
+from rb.agent import attempt_once, run, new_branch, ensure_git, git_session, add_worktree, remove_worktree, worktree_root, local_changes
 
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--repo", required=True, help="Path to git repo")
     ap.add_argument("--issue", required=True, help="Path to issue.md or inline string")
-    ap.add_argument("--test-cmd", default="pytest -q", help="Command to run tests")
-    ap.add_argument("--k", type=int, default=1, help="Parallel attempts (Best-of-N)")
+    ap.add_argument("--test-cmd", default="pytest -q", help="Command to run tests (split with shlex, run without a shell)")
+    ap.add_argument("--k", type=int, default=1, help="Parallel attempts (Best-of-N), each in its own work tree starting from HEAD plus the uncommitted changes")
     ap.add_argument("--refine", type=int, default=0, help="Sequential self-refine rounds per attempt")
+    ap.add_argument("--incremental-tests", action="store_true", help="With pytest, only run the test files that cover each attempt's changes")
+    ap.add_argument("--jobs", type=int, default=4, help="Max attempts running at once when --k > 1")
     args = ap.parse_args()
 
+    test_cmd = shlex.split(args.test_cmd)
+    if not test_cmd:
+        ap.error("--test-cmd must not be empty")
     repo = os.path.abspath(args.repo)
     ensure_git(repo)
 
@@ -25,13 +31,51 @@ def main():
     llm = LLM()
     store = MemoryStore()
 
-    results = []
+    # Every attempt conditions on the same retrieved memory, so look it up once
+    # (a Graphiti search is a Neo4j query plus an embedding call).
+    retrieved = store.search(issue_text, top_k=1)
+
     base_branch_name = "rb-attempt"
-    for i in range(1, args.k + 1):
+    # With --k > 1 every attempt runs in its own linked work tree (checked out
+    # from HEAD plus the main checkout's uncommitted changes), so attempts don't
+    # serialize on one checkout and can overlap their LLM calls and test runs.
+    attempts_root = worktree_root(repo)
+    if args.k > 1:
+        # A previous --k 1 run may have left the main checkout on an attempt
+        # branch, which `worktree add -B` refuses to reset; detach at the same commit.
+        _, head = git_session(repo).git("symbolic-ref", "--short", "-q", "HEAD")
+        if head.strip().startswith(base_branch_name + "-"):
+            git_session(repo).git("checkout", "-q", "--detach")
+        changes = local_changes(repo)
+    else:
+        # A previous --k > 1 run keeps its best attempt's work tree, which still
+        # holds that branch; `checkout -B` in the main checkout must not reset it.
+        remove_worktree(repo, os.path.join(attempts_root, f"{base_branch_name}-1"))
+
+    # Set by the first successful attempt; the others then stop early.
+    stop = threading.Event() if args.k > 1 else None
+
+    def attempt(i: int):
         branch = f"{base_branch_name}-{i}"
-        res = attempt_once(repo, issue_text, args.test_cmd, llm, store, branch, self_refine_rounds=args.refine)
-        results.append(res)
-        print(f"[attempt {i}] success={res['success']} branch={res['branch']}")
+        workdir = add_worktree(repo, os.path.join(attempts_root, branch), branch, changes) if args.k > 1 else repo
+        res = attempt_once(workdir, issue_text, test_cmd, llm, store, branch, self_refine_rounds=args.refine, incremental_tests=args.incremental_tests, retrieved=retrieved, stop=stop)
+        res["worktree"] = workdir
+        print(f"[attempt {i}] success={res['success']} skipped={res['skipped']} branch={res['branch']}")
+        return res
+
+    if args.k > 1:
+        with ThreadPoolExecutor(max_workers=max(1, min(args.k, args.jobs))) as ex:
+            futures = [ex.submit(attempt, i) for i in range(1, args.k + 1)]
+            for fut in as_completed(futures):
+                if fut.result()["success"]:
+                    # Stop at the first success: attempts that haven't started are
+                    # cancelled, running ones skip their remaining steps (see `stop`).
+                    for f in futures:
+                        f.cancel()
+                    break
+        results = [f.result() for f in futures if not f.cancelled()]
+    else:
+        results = [attempt(1)]
 
     # pick best: prefer any success; else keep attempt 1
     best = None
@@ -42,8 +86,12 @@ def main():
     if not best:
         best = results[0]
 
-    # switch to best branch for convenience
-    os.system(f"cd {repo} && git checkout {best['branch']}")
+    if args.k > 1:
+        # keep only the best attempt's work tree
+        for r in results:
+            if r is not best:
+                remove_worktree(repo, r["worktree"])
+    # With --k 1 the attempt ran in the main checkout, which is left on its branch.
 
     # write run report
     os.makedirs("runs", exist_ok=True)
@@ -51,6 +99,8 @@ def main():
     with open(f"runs/run_{ts}.json", "w", encoding="utf-8") as f:
         json.dump(results, f, ensure_ascii=False, indent=2)
     print(f"\nBest attempt: {best['branch']} (success={best['success']})")
+    if args.k > 1:
+        print(f"Best attempt's work tree: {best['worktree']}")
     print(f"Full run saved to runs/run_{ts}.json")
     print("Memory appended to memory/memory.jsonl")
 
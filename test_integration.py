@@ -3,28 +3,44 @@
 Simple integration test for ReasoningBank memory system.
 Tests both JSONL and Graphiti modes (if configured).
 """
+import io
 import os
+import re
+import subprocess
+import sys
 import tempfile
+import threading
+import traceback
 import json
+from concurrent.futures import ThreadPoolExecutor
 from rb.memory_store import MemoryStore, MemoryItem
+from rb.agent import _git_style_patch, _narrowable_pytest, _short_status, select_tests
 import time
 
+# Keep test stores in RAM (tmpfs) where available; the tests don't need durable I/O.
+TMP_ROOT = "/dev/shm" if os.access("/dev/shm", os.W_OK) else None
+
+# RB_STORE picks the backend even for MemoryStore(use_graphiti=False), so tests
+# of TF-IDF/BM25-specific behaviour skip themselves when it selects another one.
+OTHER_BACKEND = os.getenv("RB_STORE") if os.getenv("RB_STORE") in ("graphiti", "faiss") else None
+
 def test_jsonl_mode():
     """Test JSONL-based memory storage and retrieval."""
     print("Testing JSONL mode...")
 
-    with tempfile.TemporaryDirectory() as tmpdir:
+    with tempfile.TemporaryDirectory(dir=TMP_ROOT) as tmpdir:
         store_path = os.path.join(tmpdir, "test_memory.jsonl")
         store = MemoryStore(path=store_path, use_graphiti=False)
 
         # Add some test memory items
+        now = time.time()
         items = [
             MemoryItem(
                 title="Fix off-by-one error",
                 description="Always check array bounds",
                 content="When iterating, use < length not <= length to avoid index errors",
                 outcome="success",
-                created_at=time.time(),
+                created_at=now,
                 source={"type": "test"}
             ),
             MemoryItem(
@@ -32,7 +48,7 @@ def test_jsonl_mode():
                 description="Check for null before dereferencing",
                 content="Always validate object existence before accessing properties",
                 outcome="failure",
-                created_at=time.time(),
+                created_at=now,
                 source={"type": "test"}
             ),
         ]
@@ -46,10 +62,10 @@ def test_jsonl_mode():
 
         # Check if the result is relevant (either result could match)
         top_result = results[0]
-        content_lower = top_result["content"].lower()
-        title_lower = top_result["title"].lower()
-        is_relevant = ("array" in content_lower or "array" in title_lower or
-                      "bounds" in content_lower or "bounds" in title_lower)
+        is_relevant = any(
+            re.search(r"array|bounds", top_result[field], re.IGNORECASE)
+            for field in ("content", "title")
+        )
 
         print(f"✓ JSONL mode: Added {len(items)} items, search returned {len(results)} results")
         print(f"  Top result: {results[0]['title']}")
@@ -57,6 +73,217 @@ def test_jsonl_mode():
 
     return True
 
+def test_jsonl_index_updates():
+    """Items added after the first search must be retrievable without reopening the store."""
+    if OTHER_BACKEND:
+        print(f"⊘ JSONL index updates: Skipped (RB_STORE={OTHER_BACKEND})")
+        return True
+
+    print("Testing JSONL index updates...")
+
+    with tempfile.TemporaryDirectory(dir=TMP_ROOT) as tmpdir:
+        store = MemoryStore(path=os.path.join(tmpdir, "test_memory.jsonl"), use_graphiti=False)
+        assert store.search("anything", top_k=1) == [], "Empty store should return nothing"
+        now = time.time()
+
+        store.add_items([
+            MemoryItem(
+                title="Retry flaky network calls",
+                description="Wrap remote calls with backoff",
+                content="Use exponential backoff for transient HTTP failures",
+                outcome="success",
+                created_at=now,
+                source={"type": "test"}
+            ),
+        ])
+        # Cached until the next add_items, which must invalidate it.
+        before = store.search("file descriptors context manager", top_k=1)
+        assert before and before[0]["title"] == "Retry flaky network calls", before
+        store.add_items([
+            MemoryItem(
+                title="Close file handles",
+                description="Use context managers for files",
+                content="Open files with a with-statement so descriptors are released",
+                outcome="success",
+                created_at=now,
+                source={"type": "test"}
+            ),
+        ])
+
+        results = store.search("file descriptors context manager", top_k=1)
+        assert results and results[0]["title"] == "Close file handles", results
+
+        reopened = MemoryStore(path=store.path, use_graphiti=False)
+        assert len(reopened.search("backoff", top_k=5)) == 2, "Reopened store should see both items"
+
+        print("✓ JSONL index updates: new items are searchable immediately")
+
+    return True
+
+def test_jsonl_outcome_filter():
+    """search(outcome=...) ranks only memories with that outcome."""
+    if OTHER_BACKEND:
+        print(f"⊘ JSONL outcome filter: Skipped (RB_STORE={OTHER_BACKEND})")
+        return True
+
+    print("Testing JSONL outcome filter...")
+
+    with tempfile.TemporaryDirectory(dir=TMP_ROOT) as tmpdir:
+        store = MemoryStore(path=os.path.join(tmpdir, "test_memory.jsonl"), use_graphiti=False)
+        now = time.time()
+        store.add_items([
+            MemoryItem(
+                title="Cache invalidation race",
+                description="Invalidate the cache under the lock",
+                content="A cache invalidation race left stale cache entries after writes",
+                outcome="failure",
+                created_at=now,
+                source={"type": "test"}
+            ),
+            MemoryItem(
+                title="Version the cache",
+                description="Bump a version on writes",
+                content="Readers compare versions to spot stale cache entries",
+                outcome="success",
+                created_at=now,
+                source={"type": "test"}
+            ),
+        ])
+        query = "cache invalidation race"
+
+        top = store.search(query, top_k=1)
+        assert top and top[0]["outcome"] == "failure", top
+        success = store.search(query, top_k=1, outcome="success")
+        assert success and success[0]["title"] == "Version the cache", success
+        assert store.search(query, top_k=5, outcome="unknown") == []
+
+        print("✓ JSONL outcome filter: only the requested outcome is returned")
+
+    return True
+
+def _check_bm25_fallback():
+    """Run by test_jsonl_bm25_fallback in a child process with sklearn blocked."""
+    with tempfile.TemporaryDirectory(dir=TMP_ROOT) as tmpdir:
+        store = MemoryStore(path=os.path.join(tmpdir, "test_memory.jsonl"), use_graphiti=False)
+        now = time.time()
+        store.add_items([
+            MemoryItem(
+                title=title, description="d", content=content, outcome="success",
+                created_at=now, source={"type": "test"}
+            )
+            for title, content in [
+                ("Pin dependencies", "Lock versions in requirements files"),
+                ("Retry flaky network calls", "Use exponential backoff for transient HTTP failures"),
+                ("Close file handles", "Open files with a with-statement"),
+            ]
+        ])
+        results = store.search_with_scores("network backoff retry", top_k=2)
+        assert store._bm25 is not None, "Expected the BM25 fallback"
+        assert [item["title"] for item, _ in results][0] == "Retry flaky network calls", results
+        assert len(results) == 2 and all(score is None for _, score in results), results
+
+def test_jsonl_bm25_fallback():
+    """Without scikit-learn the JSONL store ranks with BM25 and reports no scores."""
+    print("Testing JSONL BM25 fallback...")
+
+    # Blocking sklearn in this process would leak into the tests running alongside.
+    code = "import sys; sys.modules['sklearn'] = None; import test_integration; test_integration._check_bm25_fallback()"
+    env = {k: v for k, v in os.environ.items() if k != "RB_STORE"}  # pin the JSONL backend
+    p = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                       env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    assert p.returncode == 0, p.stdout
+
+    print("✓ JSONL BM25 fallback: ranked without scikit-learn, scores are None")
+
+    return True
+
+def test_short_status():
+    """Porcelain v2 records render as `git status --porcelain` lines."""
+    print("Testing porcelain v2 status parsing...")
+
+    cases = [
+        ("1 .M N... 100644 100644 100644 1111 1111 rb/agent.py", " M rb/agent.py"),
+        ("1 A. N... 000000 100644 100644 0000 2222 docs/new file.md", "A  docs/new file.md"),
+        ("2 R. N... 100644 100644 100644 3333 3333 R100 new.py\told.py", "R  old.py -> new.py"),
+        ("u UU N... 100644 100644 100644 100644 4444 5555 6666 conflict.py", "UU conflict.py"),
+        ("? untracked.txt", "?? untracked.txt"),
+        ("! build/out.o", "!! build/out.o"),
+    ]
+    for line, expected in cases:
+        got = _short_status(line)
+        assert got == expected, (line, got)
+
+    print(f"✓ Porcelain v2 status: {len(cases)} record types parsed")
+
+    return True
+
+def test_git_style_patch():
+    """Plain unified diffs get the `diff --git` headers libgit2 needs."""
+    print("Testing git-style patch headers...")
+
+    hunk = "@@ -1 +1 @@\n-x\n+y\n"
+    cases = [
+        ("--- a/m.py\n+++ b/m.py\n" + hunk,
+         "diff --git a/m.py b/m.py\n--- a/m.py\n+++ b/m.py\n" + hunk),
+        # No a/ b/ prefixes, timestamps after a tab.
+        ("--- m.py\t2024-01-01 00:00:00\n+++ m.py\t2024-01-02 00:00:00\n" + hunk,
+         "diff --git a/m.py b/m.py\n--- m.py\t2024-01-01 00:00:00\n+++ m.py\t2024-01-02 00:00:00\n" + hunk),
+        ("--- /dev/null\n+++ b/new.py\n@@ -0,0 +1 @@\n+y\n",
+         "diff --git a/new.py b/new.py\nnew file mode 100644\n--- /dev/null\n+++ b/new.py\n@@ -0,0 +1 @@\n+y\n"),
+        ("--- a/old.py\n+++ /dev/null\n@@ -1 +0,0 @@\n-x\n",
+         "diff --git a/old.py b/old.py\ndeleted file mode 100644\n--- a/old.py\n+++ /dev/null\n@@ -1 +0,0 @@\n-x\n"),
+        # Already git-style: left as is.
+        ("diff --git a/m.py b/m.py\nindex 1..2 100644\n--- a/m.py\n+++ b/m.py\n" + hunk, None),
+    ]
+    for patch, expected in cases:
+        got = _git_style_patch(patch)
+        assert got == (patch if expected is None else expected), (patch, got)
+    # Each file of a multi-file diff gets its own header.
+    two = _git_style_patch("--- a/a.py\n+++ b/a.py\n" + hunk + "--- a/b.py\n+++ b/b.py\n" + hunk)
+    assert two.count("diff --git ") == 2, two
+
+    print(f"✓ Git-style patch headers: {len(cases) + 1} patches converted")
+
+    return True
+
+def test_select_tests():
+    """Changed paths map to covering pytest files, or None for the full suite."""
+    print("Testing incremental test selection...")
+
+    with tempfile.TemporaryDirectory(dir=TMP_ROOT) as repo:
+        for path in ["pkg/foo.py", "pkg/bar.py", "tests/test_foo.py", "tests/baz_test.py", "venv/test_foo.py"]:
+            os.makedirs(os.path.join(repo, os.path.dirname(path)), exist_ok=True)
+            open(os.path.join(repo, path), "w").close()
+
+        cases = [
+            ([], None),
+            (["pkg/foo.py"], ["tests/test_foo.py"]),  # venv/ is skipped
+            (["tests/baz_test.py"], ["tests/baz_test.py"]),
+            (["tests/test_gone.py"], []),  # deleted test file
+            (["pkg/foo.py", "tests/baz_test.py"], ["tests/baz_test.py", "tests/test_foo.py"]),
+            (["README.md"], None),
+            (["pkg/bar.py"], None),  # no matching test file
+            (["pkg/foo.py", "setup.cfg"], None),
+        ]
+        for changed, expected in cases:
+            got = select_tests(repo, changed)
+            assert got == expected, (changed, got)
+
+        commands = [
+            (["pytest", "-q"], True),
+            (["/usr/bin/pytest"], True),
+            (["python", "-m", "pytest", "-q"], True),
+            (["pytest", "-q", "tests"], False),  # already names paths
+            (["python", "run_tests.py"], False),
+            (["make", "test"], False),
+        ]
+        for cmd, expected in commands:
+            assert _narrowable_pytest(repo, cmd) == expected, cmd
+
+    print(f"✓ Incremental test selection: {len(cases)} change sets, {len(commands)} commands")
+
+    return True
+
 def test_graphiti_mode():
     """Test Graphiti-based memory storage and retrieval."""
     if os.getenv("RB_STORE") != "graphiti":
@@ -102,32 +329,68 @@ def test_graphiti_mode():
 
     return True
 
-if __name__ == "__main__":
-    print("=" * 60)
-    print("ReasoningBank Memory Integration Tests")
-    print("=" * 60)
+class _ThreadOutput(io.TextIOBase):
+    """stdout that sends each worker thread's output to that thread's buffer, so
+    tests running concurrently don't interleave their prints."""
 
-    results = []
+    def __init__(self, stream):
+        self._stream = stream
+        self._local = threading.local()
+
+    def capture(self, buf):
+        self._local.buf = buf
 
-    # Test JSONL mode
+    def write(self, s):
+        return getattr(self._local, "buf", self._stream).write(s)
+
+    def flush(self):
+        self._stream.flush()
+
+def _run_test(out, fn, label, show_traceback):
+    """Run one test in a worker thread; returns (passed, captured output)."""
+    buf = io.StringIO()
+    out.capture(buf)
     try:
-        results.append(("JSONL", test_jsonl_mode()))
+        passed = fn()
     except Exception as e:
-        import traceback
-        print(f"✗ JSONL mode failed: {e}")
-        traceback.print_exc()
-        results.append(("JSONL", False))
+        print(f"✗ {label} failed: {e}")
+        if show_traceback:
+            print(traceback.format_exc(), end="")
+        passed = False
+    return passed, buf.getvalue()
 
-    print()
+if __name__ == "__main__":
+    print("=" * 60)
+    print("ReasoningBank Memory Integration Tests")
+    print("=" * 60)
 
-    # Test Graphiti mode
+    # (name, test, label, print traceback on failure). The tests share no state,
+    # and the Graphiti one mostly waits on the network, so run them concurrently.
+    tests = [
+        ("JSONL", test_jsonl_mode, "JSONL mode", True),
+        ("JSONL updates", test_jsonl_index_updates, "JSONL index updates", True),
+        ("JSONL outcome", test_jsonl_outcome_filter, "JSONL outcome filter", True),
+        ("JSONL BM25", test_jsonl_bm25_fallback, "JSONL BM25 fallback", True),
+        ("Git status", test_short_status, "Porcelain v2 status", True),
+        ("Git patch", test_git_style_patch, "Git-style patch headers", True),
+        ("Test selection", test_select_tests, "Incremental test selection", True),
+        ("Graphiti", test_graphiti_mode, "Graphiti mode", False),
+    ]
+    out = _ThreadOutput(sys.stdout)
+    sys.stdout = out
     try:
-        results.append(("Graphiti", test_graphiti_mode()))
-    except Exception as e:
-        print(f"✗ Graphiti mode failed: {e}")
-        results.append(("Graphiti", False))
+        with ThreadPoolExecutor(max_workers=len(tests)) as ex:
+            futures = [ex.submit(_run_test, out, fn, label, tb) for _, fn, label, tb in tests]
+            outcomes = [f.result() for f in futures]
+    finally:
+        sys.stdout = out._stream
+
+    # Print each test's output in order once all have finished.
+    results = []
+    for (name, *_), (passed, output) in zip(tests, outcomes):
+        print(output)
+        results.append((name, passed))
 
-    print()
     print("=" * 60)
     print("Test Summary:")
     for name, passed in results: